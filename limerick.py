@@ -1,11 +1,6 @@
 #!/usr/bin/env python
 import argparse
 import sys
-import codecs
-if sys.version_info[0] == 2:
-  from itertools import izip
-else:
-  izip = zip
 from collections import defaultdict as dd
 import re
 import os.path
@@ -13,31 +8,58 @@ import gzip
 import tempfile
 import shutil
 import atexit
-
-# Use word_tokenize to split raw text into words
-from string import punctuation
+import functools
+import hashlib
+import pickle
 
 import nltk
 from nltk.tokenize import word_tokenize
 
 scriptdir = os.path.dirname(os.path.abspath(__file__))
 
-reader = codecs.getreader('utf8')
-writer = codecs.getwriter('utf8')
+# Derived CMUdict indices are pickled here so later runs skip rebuilding them.
+# Bump _INDEX_VERSION whenever the layout of the indices changes.
+_INDEX_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'limerick_detector')
+_INDEX_VERSION = 4
+
+# Words in a poem line: runs of letters (any script), keeping apostrophes
+# inside a word.  Digits and all other punctuation, including leading and
+# trailing apostrophes, are dropped.
+_WORD_RE = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)*")
+
+# ASCII punctuation except the apostrophe (and backslash), for
+# LimerickDetector.apostrophe_tokenize
+_PUNCT_TABLE = str.maketrans('', '', '!"#$%&()*+,-./:;<=>?@[]^_`{|}~')
+
+# Patterns used by LimerickDetector.guess_syllables
+_VOWEL_GROUP = re.compile(r'[aeiou]+')
+_TRAIL_E = re.compile(r'[^aeioul]e$')
+_CONS_Y = re.compile(r'[^aeiou]y')
+
+@functools.lru_cache(maxsize=8192)
+def _guess_syllables(word):
+
+    word = word.lower()
+    count = len(_VOWEL_GROUP.findall(word))
+    # Usually if words end with e, it won't count towards a syllable
+    # Eg. : Farce, Terse
+    # except when the ending e is preceded by l
+    # Eg. : Able, tickle
+    if _TRAIL_E.search(word):
+        count -= 1
+
+    # If a word has y preceded by consonant, it counts as a syllable
+    if _CONS_Y.search(word):
+        count += 1
+
+    # For words with single e at the end, count can go to 0
+    # Eg: she
+    return max(1, count)
 
 def prepfile(fh, code):
   if type(fh) is str:
-    fh = open(fh, code)
-  ret = gzip.open(fh.name, code if code.endswith("t") else code+"t") if fh.name.endswith(".gz") else fh
-  if sys.version_info[0] == 2:
-    if code.startswith('r'):
-      ret = reader(fh)
-    elif code.startswith('w'):
-      ret = writer(fh)
-    else:
-      sys.stderr.write("I didn't understand code "+code+"\n")
-      sys.exit(1)
-  return ret
+    fh = open(fh, code, encoding='utf-8')
+  return gzip.open(fh.name, code if code.endswith("t") else code+"t", encoding='utf-8') if fh.name.endswith(".gz") else fh
 
 def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
   ''' add the switches --arg and --no-arg that set parser.arg to true/false, respectively'''
@@ -50,11 +72,97 @@ def addonoffarg(parser, arg, dest=None, default=True, help="TODO"):
 
 class LimerickDetector:
 
+    # CMUdict vowel phonemes, without their stress digit
+    _VOWEL_PHONEMES = frozenset(['AA', 'AE', 'AH', 'AO', 'AW', 'AY', 'EH', 'ER',
+                                 'EY', 'IH', 'IY', 'OW', 'OY', 'UH', 'UW'])
+
+    # Attributes saved to and restored from the on-disk index cache
+    _INDEX_ATTRS = ('_syllable_by_word', '_rhyme_tails')
+
+    # Number of normalized texts whose is_limerick result is remembered
+    _LIMERICK_CACHE_SIZE = 1024
+
     def __init__(self):
         """
-        Initializes the object to have a pronunciation dictionary available
+        Initializes the object with syllable counts and rhyme tails derived
+        from the CMU pronunciation dictionary
         """
-        self._pronunciations = nltk.corpus.cmudict.dict()
+        path = self._index_cache_path()
+        if not self._load_indices(path):
+            self._build_indices()
+            self._save_indices(path)
+        self._limerick_cache = {}
+
+    def _build_indices(self):
+        # The raw dictionary is only needed to derive the indices, so it is
+        # neither kept on the instance nor cached on disk
+        pronunciation_dict = nltk.corpus.cmudict.dict()
+        self._syllable_by_word = {}
+        self._rhyme_tails = {}
+        # Rhyme tails are stored as bytes, one small id per phoneme, so they
+        # compare with memcmp and take a byte per phoneme.  Stress digits are
+        # kept, so 'AH0' and 'AH1' get different ids.
+        phoneme_ids = {}
+        for word, pronunciations in pronunciation_dict.items():
+            self._syllable_by_word[word] = self.count_syllables(pronunciations)
+            tails = tuple(bytes(phoneme_ids.setdefault(phoneme, len(phoneme_ids)) for phoneme in tail)
+                          for tail in self.strip_sounds(pronunciations))
+            self._rhyme_tails[word] = tails
+
+    def _index_cache_path(self):
+        """
+        Returns the path of the pickled indices for the installed CMUdict,
+        keyed on the dictionary file's location, size and mtime, or None if
+        the file can't be located.
+        """
+
+        try:
+            pointer = nltk.corpus.cmudict.abspath('cmudict')
+            source = pointer.path if hasattr(pointer, 'path') else pointer.zipfile.filename
+            stat = os.stat(source)
+        except (LookupError, OSError, AttributeError):
+            return None
+
+        key = "{}:{}:{}:{}".format(_INDEX_VERSION, source, stat.st_size, stat.st_mtime)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(_INDEX_CACHE_DIR, "idx-{}.pkl".format(digest))
+
+    def _load_indices(self, path):
+        if path is None:
+            return False
+        # Any unreadable, corrupt or stale pickle just means rebuilding
+        try:
+            with open(path, 'rb') as fh:
+                indices = pickle.load(fh)
+        except Exception:
+            return False
+        if not isinstance(indices, dict) or not all(name in indices for name in self._INDEX_ATTRS):
+            return False
+        for name in self._INDEX_ATTRS:
+            setattr(self, name, indices[name])
+        return True
+
+    def _save_indices(self, path):
+        # A missing or read-only cache directory just means rebuilding next
+        # time.  Write to a temporary file first so a concurrent reader never
+        # sees a partial pickle.
+        if path is None:
+            return
+        indices = dict((name, getattr(self, name)) for name in self._INDEX_ATTRS)
+        try:
+            os.makedirs(_INDEX_CACHE_DIR, exist_ok=True)
+            fh = tempfile.NamedTemporaryFile(dir=_INDEX_CACHE_DIR, delete=False)
+        except OSError:
+            return
+        try:
+            with fh:
+                pickle.dump(indices, fh, pickle.HIGHEST_PROTOCOL)
+            os.replace(fh.name, path)
+        except Exception:
+            try:
+                os.unlink(fh.name)
+            except OSError:
+                pass
 
     def num_syllables(self, word):
         """
@@ -63,32 +171,30 @@ class LimerickDetector:
         dictionary, return 1.
         """
 
-        pronunciations = self._pronunciations.get(word)
+        return self._syllable_by_word.get(word, 1)
 
-        if pronunciations is None:
-            return 1
-
-        syllable_count = []
-        for pronunciation in pronunciations:
-            count = 0
-            for phoneme in pronunciation:
-                phoneme = phoneme.encode('ascii', 'ignore')
-                if phoneme[0] in 'AEIOU':
-                    count = count + 1
-            syllable_count.append(count)
+    def count_syllables(self, pronunciations):
+        """
+        Returns the number of syllables in the shortest of the given
+        pronunciations.
+        """
 
-        return min(syllable_count)
+        return min(sum(1 for phoneme in pronunciation if phoneme[:2] in self._VOWEL_PHONEMES)
+                   for pronunciation in pronunciations)
 
     def strip_sounds(self, pronunciations):
+        """
+        Returns the pronunciations with everything before the first vowel
+        sound removed, as a tuple of phoneme tuples.
+        """
 
         stripped_pronunciations = []
         for pronunciation in pronunciations:
             for idx, phoneme in enumerate(pronunciation):
-                phoneme = phoneme.encode('ascii', 'ignore')
-                if phoneme[0] in 'AEIOU':
-                    stripped_pronunciations.append(pronunciation[idx:])
+                if phoneme[:2] in self._VOWEL_PHONEMES:
+                    stripped_pronunciations.append(tuple(pronunciation[idx:]))
                     break
-        return stripped_pronunciations
+        return tuple(stripped_pronunciations)
 
     def rhymes(self, a, b):
         """
@@ -96,38 +202,18 @@ class LimerickDetector:
         False otherwise.
         """
 
-        pronunciations_a = self._pronunciations.get(a)
-        pronunciations_b = self._pronunciations.get(b)
-
-        list_a = self.strip_sounds(pronunciations_a)
-        list_b = self.strip_sounds(pronunciations_b)
-
-        for a in list_a:
-            for b in list_b:
-                len_a = len(a)
-                len_b = len(b)
-                if len_a == len_b:
-                    if a == b:
-                        return True
-                elif len_a > len_b:
-                    if a[len_a-len_b:] == b:
-                        return True
-                else:
-                    if b[len_b-len_a:] == a:
-                        return True
+        # Two words rhyme when one tail is a suffix of the other
+        tails_b = self._rhyme_tails.get(b, ())
+        for tail_a in self._rhyme_tails.get(a, ()):
+            for tail_b in tails_b:
+                if tail_a.endswith(tail_b) or tail_b.endswith(tail_a):
+                    return True
 
         return False
 
     def get_line_syllable_count(self, line_words):
-        syllable_count = 0
-        for word in line_words:
-            syllable_count += self.num_syllables(word)
-
-        return syllable_count
-
-    def remove_punctuations(self, line_words):
-        tokens = [word for word in line_words if word not in punctuation and word != "``" and word != "''"]
-        return tokens
+        syllable_by_word = self._syllable_by_word
+        return sum(syllable_by_word.get(word, 1) for word in line_words)
 
     def is_limerick(self, text):
         """
@@ -151,60 +237,74 @@ class LimerickDetector:
 
         """
 
-        all_lines = text.splitlines()
-        lines = [line for line in all_lines if line.strip() != '']
-        num_of_lines = len(lines)
-        if num_of_lines != 5:
-            return False
+        return self._cached_is_limerick(self._normalize_text(text))
 
-        # Check if first two lines rhyme
-        line1_words = word_tokenize(lines[0])
-        line1_words = self.remove_punctuations(line1_words)
-
-        line2_words = word_tokenize(lines[1])
-        line2_words = self.remove_punctuations(line2_words)
+    def are_limericks(self, texts):
+        """
+        Takes a list of texts and returns a list of booleans, one per text, as
+        is_limerick would.  Texts that only differ in blank lines or
+        surrounding whitespace are checked once.
+        """
 
-        if not self.rhymes(line1_words[len(line1_words)-1], line2_words[len(line2_words)-1]):
-            return False
+        # The result cache holds only _LIMERICK_CACHE_SIZE texts, so a large
+        # batch could evict a text before its duplicate comes up; this dict
+        # keeps the whole batch
+        results = {}
+        answers = []
+        for text in texts:
+            text = self._normalize_text(text)
+            if text not in results:
+                results[text] = self._cached_is_limerick(text)
+            answers.append(results[text])
+        return answers
+
+    def _cached_is_limerick(self, text):
+        # A plain dict kept in least-recently-used order: hits move to the
+        # end and the oldest entry is evicted once the cache is full.  Unlike
+        # an lru_cache wrapper stored on the instance, this keeps the detector
+        # picklable and creates no reference cycle.
+        cache = self._limerick_cache
+        if text in cache:
+            result = cache.pop(text)
+        else:
+            result = self._is_limerick(text)
+            if len(cache) >= self._LIMERICK_CACHE_SIZE:
+                del cache[next(iter(cache))]
+        cache[text] = result
+        return result
 
-        # Check if third and fourth lines rhyme
-        line3_words = word_tokenize(lines[2])
-        line3_words = self.remove_punctuations(line3_words)
+    def _normalize_text(self, text):
+        # Blank lines and surrounding whitespace don't affect the result, so
+        # drop them before looking the text up in the cache
+        return "\n".join(line.strip() for line in text.splitlines() if line.strip())
 
-        line4_words = word_tokenize(lines[3])
-        line4_words = self.remove_punctuations(line4_words)
-        if not self.rhymes(line3_words[len(line3_words)-1], line4_words[len(line4_words)-1]):
-            return False
+    def _is_limerick(self, text):
 
-        # Check if first and fifth or second and fifth lines rhyme
-        line5_words = word_tokenize(lines[4])
-        line5_words = self.remove_punctuations(line5_words)
-        if not self.rhymes(line1_words[len(line1_words)-1], line5_words[len(line5_words)-1])\
-                and not self.rhymes(line2_words[len(line2_words)-1], line5_words[len(line5_words)-1]):
+        lines = text.splitlines()
+        num_of_lines = len(lines)
+        if num_of_lines != 5:
             return False
 
-        # Check that first and third lines do not rhyme
-        if self.rhymes(line1_words[len(line1_words)-1], line3_words[len(line3_words)-1]):
+        lines_words = [_WORD_RE.findall(line) for line in lines]
+        if not all(lines_words):
             return False
+        last = [line_words[-1].lower() for line_words in lines_words]
 
+        # Syllable counts are cheap, so rule texts out on them before doing
+        # any rhyme lookups
         '''
           * No two A lines should differ in their number of syllables by more than two.
           * The B lines should differ in their number of syllables by no more than two.
           * Each of the B lines should have fewer syllables than each of the A lines.
           * No line should have fewer than 4 syllables
         '''
-        syllable_count = []
-        syllable_count.append(self.get_line_syllable_count(line1_words))
-        syllable_count.append(self.get_line_syllable_count(line2_words))
-        syllable_count.append(self.get_line_syllable_count(line3_words))
-        syllable_count.append(self.get_line_syllable_count(line4_words))
-        syllable_count.append(self.get_line_syllable_count(line5_words))
-
-        if True in [t < 4 for t in syllable_count]:
+        syllable_count = tuple(self.get_line_syllable_count(line_words) for line_words in lines_words)
+
+        if any(t < 4 for t in syllable_count):
             return False
 
-        a_syllable_max = max([syllable_count[0], syllable_count[1], syllable_count[4]])
-        a_syllable_min = min([syllable_count[0], syllable_count[1], syllable_count[4]])
+        a_syllable_max = max(syllable_count[0], syllable_count[1], syllable_count[4])
+        a_syllable_min = min(syllable_count[0], syllable_count[1], syllable_count[4])
 
         if (a_syllable_max - a_syllable_min) > 2:
             return False
@@ -212,6 +312,22 @@ class LimerickDetector:
         if abs(syllable_count[2] - syllable_count[3]) > 2:
             return False
 
+        # Check if first two lines rhyme
+        if not self.rhymes(last[0], last[1]):
+            return False
+
+        # Check if third and fourth lines rhyme
+        if not self.rhymes(last[2], last[3]):
+            return False
+
+        # Check if first and fifth or second and fifth lines rhyme
+        if not self.rhymes(last[0], last[4]) and not self.rhymes(last[1], last[4]):
+            return False
+
+        # Check that first and third lines do not rhyme
+        if self.rhymes(last[0], last[2]):
+            return False
+
         return True
 
     def apostrophe_tokenize(self, line):
@@ -219,40 +335,18 @@ class LimerickDetector:
             return word_tokenize(line)
         else:
             # Remove all punctuations other than apostrophe
-            line = re.sub('[!\"#$%&()*+,-./:;<=>?@[\]^_`{|}~]', "", line)
-            tokens = line.split()
-            return tokens
+            return line.translate(_PUNCT_TABLE).split()
 
     def guess_syllables(self, word):
-
-        word = word.lower()
-        matches = re.findall(r'[aeiou]+', word)
-
-        count = len(matches)
-        # Usually if words end with e, it won't count towards a syllable
-        # Eg. : Farce, Terse
-        # except when the ending e is preceded by l
-        # Eg. : Able, tickle
-
-        match = re.search(r'[^aeioul]e$', word, re.M|re.I)
-        if match:
-            count -= 1
-
-        # If a word has y preceded by consonant, it counts as a syllable
-        matches = re.findall(r'[^aeiou]y.*', word)
-        count += len(matches)
-
-        # For words with single e at the end, count can go to 0
-        # Eg: she
-        return max(1, count)
+        return _guess_syllables(word)
 
 # The code below should not need to be modified
 def main():
   parser = argparse.ArgumentParser(description="limerick detector. Given a file containing a poem, indicate whether that poem is a limerick or not",
                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
   addonoffarg(parser, 'debug', help="debug mode", default=False)
-  parser.add_argument("--infile", "-i", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="input file")
-  parser.add_argument("--outfile", "-o", nargs='?', type=argparse.FileType('w'), default=sys.stdout, help="output file")
+  parser.add_argument("--infile", "-i", nargs='?', type=argparse.FileType('r', encoding='utf-8'), default=sys.stdin, help="input file")
+  parser.add_argument("--outfile", "-o", nargs='?', type=argparse.FileType('w', encoding='utf-8'), default=sys.stdout, help="output file")
 
 
 
@@ -266,11 +360,11 @@ def main():
   outfile = prepfile(args.outfile, 'w')
 
   ld = LimerickDetector()
-  lines = ''.join(infile.readlines())
+  lines = infile.read()
   outfile.write("{}\n-----------\n{}\n".format(lines.strip(), ld.is_limerick(lines)))
 
-  print ld.num_syllables("vile")
-  print ld.guess_syllables("vile")
+  print(ld.num_syllables("vile"))
+  print(ld.guess_syllables("vile"))
 
 if __name__ == '__main__':
   main()
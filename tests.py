@@ -1,8 +1,27 @@
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
+from unittest import mock
+
+import limerick
 from limerick import LimerickDetector
 
 class TestSequenceFunctions(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        # Keep the pickled CMUdict indices out of the real ~/.cache
+        cls.saved_cache_dir = limerick._INDEX_CACHE_DIR
+        cls.cache_dir = tempfile.mkdtemp()
+        limerick._INDEX_CACHE_DIR = cls.cache_dir
+
+    @classmethod
+    def tearDownClass(cls):
+        limerick._INDEX_CACHE_DIR = cls.saved_cache_dir
+        shutil.rmtree(cls.cache_dir)
+
     def setUp(self):
         self.ld = LimerickDetector()
 
@@ -39,8 +58,8 @@ class TestSequenceFunctions(unittest.TestCase):
         try: self.assertEqual(self.ld.rhymes("cup", "duck"), False)
         except: s.append(15)
 
-        print '\nNumber of failed rhyme tests:', str(len(s))
-        if len(s)!=0: print 'Failed rhyme tests:', ','.join([str(x) for x in s])
+        print('\nNumber of failed rhyme tests:', str(len(s)))
+        if len(s)!=0: print('Failed rhyme tests:', ','.join([str(x) for x in s]))
 
     def test_syllables(self):
         s = []
@@ -67,8 +86,8 @@ class TestSequenceFunctions(unittest.TestCase):
         try: self.assertEqual(self.ld.num_syllables("reluctant"), 3)
         except: s.append(11)
 
-        print '\nNumber of failed syllables tests:', str(len(s))
-        if len(s)!=0: print 'Failed syllables tests:', ','.join([str(x) for x in s])
+        print('\nNumber of failed syllables tests:', str(len(s)))
+        if len(s)!=0: print('Failed syllables tests:', ','.join([str(x) for x in s]))
 
     def test_examples(self):
 
@@ -135,8 +154,94 @@ Front page, sporting section and all."""
         try: self.assertEqual(self.ld.is_limerick(g), True)
         except: s.append('g')
 
-        print 'Number of failed limerick tests:', str(len(s))
-        if len(s)!=0: print 'Failed limerick tests:', ','.join(s)
+        print('Number of failed limerick tests:', str(len(s)))
+        if len(s)!=0: print('Failed limerick tests:', ','.join(s))
+
+    def test_line_words(self):
+        self.assertEqual(limerick._WORD_RE.findall("a fan of the dogs'"), ["a", "fan", "of", "the", "dogs"])
+        self.assertEqual(limerick._WORD_RE.findall("while it's true all i've done"),
+                         ["while", "it's", "true", "all", "i've", "done"])
+        self.assertEqual(limerick._WORD_RE.findall('Replied, "At eleven,'), ["Replied", "At", "eleven"])
+        self.assertEqual(limerick._WORD_RE.findall("'quoted' words"), ["quoted", "words"])
+        self.assertEqual(limerick._WORD_RE.findall("!!! -- ..."), [])
+
+        # A line without any words can't end in a rhyme
+        self.assertEqual(self.ld.is_limerick("dog dog dog dog\nbog bog bog bog\n!!!\n"
+                                             "cat cat cat cat\ndog dog dog dog"), False)
+
+    def test_are_limericks(self):
+        a = """There was a young lady one fall
+Who wore a newspaper dress to a ball.
+The dress caught fire
+And burned her entire
+Front page, sporting section and all."""
+
+        b = "dog\ndog\ndog\ndog\ndog"
+
+        texts = [a, b, "\n" + a + "\n", b]
+        self.assertEqual(self.ld.are_limericks(texts), [True, False, True, False])
+        self.assertEqual(self.ld.are_limericks([]), [])
+
+    def test_limerick_cache(self):
+        self.ld._LIMERICK_CACHE_SIZE = 2
+        texts = ["dog\ndog", "cat\ncat", "bog\nbog"]
+        for text in texts:
+            self.assertEqual(self.ld.is_limerick(text), False)
+        # Oldest text is evicted once the cache is full
+        self.assertEqual(list(self.ld._limerick_cache), texts[1:])
+        self.ld.is_limerick("  cat\n\ncat  ")
+        self.assertEqual(list(self.ld._limerick_cache), [texts[2], texts[1]])
+
+    def test_pickle(self):
+        words = ["dog", "bog", "cat", "letter"]
+        self.ld.is_limerick("dog\ndog")
+        copy = pickle.loads(pickle.dumps(self.ld))
+        self.assertEqual([copy.rhymes(a, b) for a in words for b in words],
+                         [self.ld.rhymes(a, b) for a in words for b in words])
+        self.assertEqual([copy.num_syllables(w) for w in words], [self.ld.num_syllables(w) for w in words])
+        self.assertEqual(copy.is_limerick("dog\ndog"), False)
+
+    def test_index_cache(self):
+        words = ["dog", "bog", "eleven", "seven", "failure", "savior", "letter", "asdf"]
+
+        def answers(ld):
+            return ([ld.rhymes(a, b) for a in words for b in words],
+                    [ld.num_syllables(w) for w in words])
+
+        limerick._INDEX_CACHE_DIR = tempfile.mkdtemp(dir=self.cache_dir)
+        try:
+            # Cold build writes the pickle
+            cold = LimerickDetector()
+            path = cold._index_cache_path()
+            self.assertTrue(os.path.exists(path))
+
+            # Warm load must not rebuild and must answer the same
+            with mock.patch.object(LimerickDetector, '_build_indices', side_effect=AssertionError("rebuilt")):
+                warm = LimerickDetector()
+            self.assertEqual(answers(warm), answers(cold))
+
+            # A pickle with the wrong content is rebuilt and rewritten
+            with open(path, 'wb') as fh:
+                pickle.dump(["not", "indices"], fh)
+            recovered = LimerickDetector()
+            self.assertEqual(answers(recovered), answers(cold))
+            with open(path, 'rb') as fh:
+                self.assertEqual(sorted(pickle.load(fh)), sorted(LimerickDetector._INDEX_ATTRS))
+        finally:
+            limerick._INDEX_CACHE_DIR = self.cache_dir
+
+    def test_index_cache_version(self):
+        # A layout change must not pick up pickles written for the old layout
+        path = self.ld._index_cache_path()
+        with mock.patch.object(limerick, '_INDEX_VERSION', limerick._INDEX_VERSION + 1):
+            new_path = self.ld._index_cache_path()
+            self.assertNotEqual(new_path, path)
+            self.assertFalse(os.path.exists(new_path))
+            with mock.patch.object(LimerickDetector, '_build_indices',
+                                   side_effect=LimerickDetector._build_indices, autospec=True) as build:
+                LimerickDetector()
+            self.assertEqual(build.call_count, 1)
+            self.assertTrue(os.path.exists(new_path))
 
 if __name__ == '__main__':
     unittest.main()